@@ -1,8 +1,13 @@
 import aiohttp
 import asyncio
+import json
 import logging
-from typing import Dict, Optional, List, Any
-from datetime import datetime, timedelta
+import random
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, List, Any, Mapping, Tuple
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from config import (
     AVITO_API_BASE_URL,
     AVITO_AUTH_URL,
@@ -10,25 +15,133 @@ from config import (
     AVITO_CLIENT_SECRET,
     AVITO_ACCESS_TOKEN,
     REQUEST_TIMEOUT,
+    DETAILS_TIMEOUT,
+    SEARCH_TIMEOUT,
+    AUTH_TIMEOUT,
+    CONNECT_TIMEOUT,
+    CACHE_TTL,
+    MAX_CACHE_ITEMS,
+    CONNECTION_LIMIT,
+    INTERACTIVE_CONCURRENCY,
+    BACKGROUND_CONCURRENCY,
+    CONNECTION_LIMIT_PER_HOST,
+    DNS_CACHE_TTL,
+    KEEPALIVE_TIMEOUT,
     MAX_RETRIES,
-    RETRY_DELAY
+    TOKEN_REFRESH_MARGIN,
+    TOKEN_REFRESH_COOLDOWN,
+    RETRY_DELAY,
+    RETRY_MAX_DELAY,
+    RATE_LIMIT_MIN_REMAINING,
+    RATE_LIMIT_MAX_WAIT,
+    CIRCUIT_FAIL_THRESHOLD,
+    CIRCUIT_RECOVERY_TIMEOUT
 )
 
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
 logger = logging.getLogger(__name__)
 
+class CircuitOpenError(Exception):
+    """API временно недоступно, запрос отклонён без обращения к серверу"""
+
+
+class AuthError(Exception):
+    """API отклонило авторизацию"""
+
+
+class TokenRefreshError(AuthError):
+    """Не удалось получить новый токен доступа"""
+
+
+class CircuitBreaker:
+    """Автоматический выключатель: CLOSED -> OPEN -> HALF_OPEN -> CLOSED"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(
+        self,
+        fail_threshold: int = CIRCUIT_FAIL_THRESHOLD,
+        recovery_timeout: float = CIRCUIT_RECOVERY_TIMEOUT
+    ):
+        self.fail_threshold = fail_threshold
+        self.recovery_timeout = recovery_timeout
+        self.failure_count = 0
+        self.opened_at: Optional[float] = None
+        self.state = self.CLOSED
+
+    def before_request(self) -> None:
+        """Проверить, можно ли выполнить запрос, иначе выбросить CircuitOpenError"""
+        if self.state == self.CLOSED:
+            return
+        if time.monotonic() - self.opened_at < self.recovery_timeout:
+            raise CircuitOpenError("Avito API временно недоступно")
+        # Пропускаем один пробный запрос; если он зависнет, через
+        # recovery_timeout будет пропущен следующий
+        self.state = self.HALF_OPEN
+        self.opened_at = time.monotonic()
+
+    def before_retry(self) -> None:
+        """Прервать повторные попытки, если цепь разомкнулась во время запроса"""
+        if self.state == self.OPEN and time.monotonic() - self.opened_at < self.recovery_timeout:
+            raise CircuitOpenError("Avito API временно недоступно")
+
+    def record_success(self) -> None:
+        """Зафиксировать успешный ответ сервера"""
+        self.failure_count = 0
+        self.opened_at = None
+        self.state = self.CLOSED
+
+    def record_failure(self) -> None:
+        """Зафиксировать отказ сервера и разомкнуть цепь при превышении порога"""
+        self.failure_count += 1
+        if self.state == self.HALF_OPEN or self.failure_count >= self.fail_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"Circuit breaker opened after {self.failure_count} failures")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
 class AvitoAPI:
     def __init__(self):
         self.base_url = AVITO_API_BASE_URL
         self.access_token = AVITO_ACCESS_TOKEN
         self.client_id = AVITO_CLIENT_ID
         self.client_secret = AVITO_CLIENT_SECRET
-        self.token_expires_at = None
+        self.token_expires_at: Optional[float] = None  # по time.monotonic(), с запасом
         self._session = None
+        self._token_lock = asyncio.Lock()
+        # Последняя неудачная попытка обновить токен: (время по time.monotonic(), ошибка)
+        self._refresh_failure: Optional[Tuple[float, Exception]] = None
+        self._breaker = CircuitBreaker()
+        # Фоновые проверки и запросы пользователей не конкурируют за соединения
+        self._semaphores = {
+            'interactive': asyncio.Semaphore(INTERACTIVE_CONCURRENCY),
+            'background': asyncio.Semaphore(BACKGROUND_CONCURRENCY)
+        }
+        self._rate_state: Optional[Tuple[int, float]] = None  # (остаток запросов, время сброса)
+        self._cache: 'OrderedDict[str, Tuple[float, Any]]' = OrderedDict()
 
     async def get_session(self) -> aiohttp.ClientSession:
         """Получить или создать сессию"""
         if self._session is None or self._session.closed:
+            # Все запросы идут на один хост, поэтому держим keep-alive соединения
+            # и ограничиваем их число на хост
+            connector = aiohttp.TCPConnector(
+                limit=CONNECTION_LIMIT,
+                limit_per_host=CONNECTION_LIMIT_PER_HOST,
+                ttl_dns_cache=DNS_CACHE_TTL,
+                keepalive_timeout=KEEPALIVE_TIMEOUT,
+                enable_cleanup_closed=True
+            )
             self._session = aiohttp.ClientSession(
+                connector=connector,
                 headers=self._get_headers(),
                 timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
             )
@@ -36,13 +149,69 @@ class AvitoAPI:
 
     def _get_headers(self) -> Dict[str, str]:
         """Получить заголовки для запросов"""
-        headers = {
+        return {
             'Content-Type': 'application/json',
-            'Accept': 'application/json'
+            'Accept': 'application/json',
+            # Accept-Encoding не задаём: aiohttp сам запрашивает gzip, deflate и br,
+            # если установлен Brotli, и распаковывает ответ
+            'Connection': 'keep-alive'
         }
+
+    def _get_auth_headers(self) -> Dict[str, str]:
+        """Получить заголовок авторизации с актуальным токеном"""
         if self.access_token:
-            headers['Authorization'] = f'Bearer {self.access_token}'
-        return headers
+            return {'Authorization': f'Bearer {self.access_token}'}
+        return {}
+
+    def _token_expired(self) -> bool:
+        """Проверить, истёк ли токен (запас уже вычтен из token_expires_at)"""
+        return self.token_expires_at is None or time.monotonic() >= self.token_expires_at
+
+    def _can_refresh_token(self) -> bool:
+        """Есть ли учётные данные для получения нового токена"""
+        return bool(self.client_id and self.client_secret)
+
+    async def _ensure_token(self) -> None:
+        """Заранее обновить токен, если он истёк или скоро истечёт"""
+        if not self._can_refresh_token():
+            # Без учётных данных обновить токен нельзя, используем статический
+            return
+        if not self._token_expired():
+            return
+        async with self._token_lock:
+            # Токен мог обновить другой запрос, пока мы ждали блокировку
+            if not self._token_expired():
+                return
+            if self._refresh_failure is not None:
+                failed_at, error = self._refresh_failure
+                if time.monotonic() - failed_at < TOKEN_REFRESH_COOLDOWN:
+                    # Обновление только что не удалось: не повторяем его для каждого ожидающего
+                    raise error
+            try:
+                await self.refresh_token()
+            except Exception as e:
+                self._refresh_failure = (time.monotonic(), e)
+                raise
+            self._refresh_failure = None
+
+    def _cache_get(self, key: str) -> Optional[Any]:
+        """Получить значение из кэша, если оно не устарело"""
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        stored_at, value = entry
+        if time.monotonic() - stored_at >= CACHE_TTL:
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return value
+
+    def _cache_set(self, key: str, value: Any) -> None:
+        """Сохранить значение в кэш, вытесняя самые старые записи"""
+        self._cache[key] = (time.monotonic(), value)
+        self._cache.move_to_end(key)
+        while len(self._cache) > MAX_CACHE_ITEMS:
+            self._cache.popitem(last=False)
 
     async def _make_request(
         self,
@@ -50,55 +219,167 @@ class AvitoAPI:
         endpoint: str,
         params: Optional[Dict] = None,
         data: Optional[Dict] = None,
-        retry_count: int = 0
+        priority: str = 'interactive',
+        timeout: float = REQUEST_TIMEOUT
     ) -> Dict:
         """Выполнить запрос к API с обработкой ошибок и повторными попытками"""
-        if retry_count >= MAX_RETRIES:
-            raise Exception(f"Превышено максимальное количество попыток для {endpoint}")
-
-        session = await self.get_session()
+        semaphore = self._semaphores[priority]
+        request_timeout = self._make_timeout(timeout)
         url = f"{self.base_url}{endpoint}"
 
+        token_refreshed = False
+
+        for attempt in range(MAX_RETRIES):
+            retry_after: Optional[float] = None
+
+            try:
+                async with semaphore:
+                    # Проверяем после ожидания в очереди: цепь могла разомкнуться,
+                    # пока запрос ждал свободного слота или повторной попытки
+                    if attempt == 0:
+                        self._breaker.before_request()
+                    else:
+                        self._breaker.before_retry()
+                    await self._ensure_token()
+                    await self._wait_for_rate_limit()
+                    session = await self.get_session()
+                    async with session.request(
+                        method,
+                        url,
+                        params=params,
+                        json=data,
+                        headers=self._get_auth_headers(),
+                        timeout=request_timeout
+                    ) as response:
+                        self._update_rate_limit(response.headers)
+
+                        if response.status == 401:
+                            # Сервер ответил, так что на выключатель 401 не влияет
+                            self._breaker.record_success()
+                            if (
+                                token_refreshed
+                                or not self._can_refresh_token()
+                                or attempt + 1 == MAX_RETRIES
+                            ):
+                                raise AuthError(f"Unauthorized request to {endpoint}")
+                            # Сбрасываем срок действия, чтобы _ensure_token обновил токен
+                            self.token_expires_at = None
+                            token_refreshed = True
+                            continue
+
+                        if response.status == 429:
+                            retry_after = self._parse_retry_after(response.headers)
+                        elif response.status < 500:
+                            # Сервер ответил, значит API доступно
+                            self._breaker.record_success()
+
+                            if response.status >= 400:
+                                # Ошибки клиента (кроме 401/429) повторять бессмысленно
+                                try:
+                                    error_data = await self._read_json(response)
+                                except ValueError:
+                                    error_data = await response.text()
+                                raise Exception(f"API error: {error_data}")
+
+                            return await self._read_json(response)
+
+            except TokenRefreshError:
+                # Сервер авторизации недоступен: без токена API тоже недоступно
+                self._breaker.record_failure()
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.error(f"Request error for {url}: {e!r}")
+
+            # Ждём вне семафора, чтобы не занимать слот соединения
+            if attempt + 1 < MAX_RETRIES:
+                if retry_after is not None:
+                    await asyncio.sleep(retry_after)
+                else:
+                    await self._backoff(attempt)
+
+        self._breaker.record_failure()
+        raise Exception(f"Превышено максимальное количество попыток для {endpoint}")
+
+    def _update_rate_limit(self, headers: Mapping[str, str]) -> None:
+        """Запомнить остаток лимита запросов из заголовков ответа"""
+        remaining = headers.get('X-RateLimit-Remaining')
+        reset = headers.get('X-RateLimit-Reset')
+        if remaining is None or reset is None:
+            return
         try:
-            async with session.request(method, url, params=params, json=data) as response:
-                response_text = await response.text()
-                logger.debug(f"Response from {url}: {response_text}")
+            remaining = int(remaining)
+            reset = float(reset)
+        except ValueError:
+            return
+        # Reset приходит либо как unix-время, либо как число секунд до сброса
+        if reset > 1e9:
+            reset -= time.time()
+        self._rate_state = (remaining, time.monotonic() + max(reset, 0))
+
+    async def _wait_for_rate_limit(self) -> None:
+        """Подождать сброса лимита, если запросов почти не осталось"""
+        if self._rate_state is None:
+            return
+        remaining, reset_at = self._rate_state
+        delay = reset_at - time.monotonic()
+        if remaining < RATE_LIMIT_MIN_REMAINING and delay > 0:
+            await asyncio.sleep(min(delay, RATE_LIMIT_MAX_WAIT))
 
-                if response.status == 401:
-                    await self.refresh_token()
-                    return await self._make_request(method, endpoint, params, data, retry_count + 1)
-                
-                if response.status >= 500:
-                    await asyncio.sleep(RETRY_DELAY)
-                    return await self._make_request(method, endpoint, params, data, retry_count + 1)
+    @staticmethod
+    def _parse_retry_after(headers: Mapping[str, str]) -> Optional[float]:
+        """Получить задержку из заголовка Retry-After (секунды или HTTP-дата)"""
+        value = headers.get('Retry-After')
+        if value is None:
+            return None
+        try:
+            delay = float(value)
+        except ValueError:
+            try:
+                delay = (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                return None
+        return min(max(delay, 0), RATE_LIMIT_MAX_WAIT)
 
-                if response.status >= 400:
-                    error_data = await response.json()
-                    raise Exception(f"API error: {error_data}")
+    @staticmethod
+    def _make_timeout(timeout: float) -> aiohttp.ClientTimeout:
+        """Таймаут запроса: быстрый отказ при установке соединения и чтении"""
+        return aiohttp.ClientTimeout(total=timeout, sock_connect=CONNECT_TIMEOUT, sock_read=timeout)
 
-                return await response.json()
+    @staticmethod
+    async def _read_json(response: aiohttp.ClientResponse) -> Any:
+        """Прочитать тело ответа один раз и разобрать JSON"""
+        body = await response.read()
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Response from {response.url}: {body.decode('utf-8', 'replace')}")
+        if not body.strip():
+            # Как и aiohttp, пустое тело считаем отсутствием данных
+            return None
+        return _json_loads(body)
 
-        except aiohttp.ClientError as e:
-            logger.error(f"Request error for {url}: {str(e)}")
-            await asyncio.sleep(RETRY_DELAY)
-            return await self._make_request(method, endpoint, params, data, retry_count + 1)
+    @staticmethod
+    async def _backoff(attempt: int) -> None:
+        """Экспоненциальная задержка с полным джиттером перед повторной попыткой"""
+        await asyncio.sleep(random.uniform(0, min(RETRY_MAX_DELAY, RETRY_DELAY * (2 ** attempt))))
 
     async def refresh_token(self) -> None:
         """Обновить токен доступа"""
-        async with aiohttp.ClientSession() as session:
-            data = {
-                'client_id': self.client_id,
-                'client_secret': self.client_secret,
-                'grant_type': 'client_credentials'
-            }
-            async with session.post(AVITO_AUTH_URL, json=data) as response:
-                if response.status == 200:
-                    token_data = await response.json()
-                    self.access_token = token_data['access_token']
-                    expires_in = token_data.get('expires_in', 3600)
-                    self.token_expires_at = datetime.now() + timedelta(seconds=expires_in)
-                else:
-                    raise Exception("Failed to refresh token")
+        session = await self.get_session()
+        data = {
+            'client_id': self.client_id,
+            'client_secret': self.client_secret,
+            'grant_type': 'client_credentials'
+        }
+        async with session.post(
+            AVITO_AUTH_URL, json=data, timeout=self._make_timeout(AUTH_TIMEOUT)
+        ) as response:
+            if response.status == 200:
+                token_data = await self._read_json(response)
+                self.access_token = token_data['access_token']
+                expires_in = token_data.get('expires_in', 3600)
+                # Монотонные часы не зависят от перевода системного времени
+                self.token_expires_at = time.monotonic() + expires_in - TOKEN_REFRESH_MARGIN
+            else:
+                raise TokenRefreshError(f"Failed to refresh token: HTTP {response.status}")
 
     async def search_items(
         self,
@@ -129,24 +410,63 @@ class AvitoAPI:
         if price_to:
             params['price_to'] = price_to
 
-        return await self._make_request('GET', '/items', params=params)
+        return await self._make_request('GET', '/items', params=params, timeout=SEARCH_TIMEOUT)
 
-    async def get_item_details(self, item_id: str) -> Dict:
+    async def get_item_details(self, item_id: str, priority: str = 'interactive') -> Dict:
         """Получить детальную информацию об объявлении"""
-        return await self._make_request('GET', f'/items/{item_id}')
+        return await self._make_request(
+            'GET', f'/items/{item_id}', priority=priority, timeout=DETAILS_TIMEOUT
+        )
 
     async def get_categories(self) -> List[Dict]:
         """Получить список категорий"""
-        return await self._make_request('GET', '/categories')
+        categories, _ = await self._get_indexed('categories', '/categories')
+        return categories
 
     async def get_locations(self, query: str) -> List[Dict]:
         """Поиск локаций по запросу"""
-        params = {'query': query}
-        return await self._make_request('GET', '/locations', params=params)
+        locations, _ = await self._get_indexed(
+            f"loc:{query.lower()}", '/locations', params={'query': query}
+        )
+        return locations
+
+    async def get_category_index(self) -> Dict[str, Any]:
+        """Получить словарь: название категории в нижнем регистре -> ID"""
+        _, index = await self._get_indexed('categories', '/categories')
+        return index
+
+    async def get_location_index(self, query: str) -> Dict[str, Any]:
+        """Получить словарь: название локации в нижнем регистре -> ID"""
+        _, index = await self._get_indexed(
+            f"loc:{query.lower()}", '/locations', params={'query': query}
+        )
+        return index
+
+    async def _get_indexed(
+        self,
+        key: str,
+        endpoint: str,
+        params: Optional[Dict] = None
+    ) -> Tuple[List[Dict], Dict[str, Any]]:
+        """Получить список из кэша или API вместе с индексом по названию (одна запись кэша)"""
+        entry = self._cache_get(key)
+        if entry is None:
+            entries = await self._make_request('GET', endpoint, params=params)
+            entry = (entries, self._build_name_index(entries))
+            self._cache_set(key, entry)
+        return entry
+
+    @staticmethod
+    def _build_name_index(entries: List[Dict]) -> Dict[str, Any]:
+        """Построить индекс по названию; при совпадении названий побеждает первая запись"""
+        index: Dict[str, Any] = {}
+        for entry in entries:
+            index.setdefault(entry['name'].lower(), entry['id'])
+        return index
 
     async def get_item_stats(self, item_id: str) -> Dict:
         """Получить статистику по объявлению"""
-        return await self._make_request('GET', f'/items/{item_id}/stats')
+        return await self._make_request('GET', f'/items/{item_id}/stats', timeout=DETAILS_TIMEOUT)
 
     async def close(self) -> None:
         """Закрыть сессию"""
@@ -1,26 +1,44 @@
+import asyncio
 import logging
-import re
-from typing import Dict, Set
+from typing import Dict, List, Optional, Set
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-from config import BOT_TOKEN, CHECK_INTERVAL, MAX_ITEMS_PER_USER, PRICE_CHANGE_THRESHOLD
-from avito_api import AvitoAPI
-
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
+from config import (
+    BOT_TOKEN,
+    DATABASE_PATH,
+    CHECK_INTERVAL,
+    MAX_ITEMS_PER_USER,
+    PRICE_CHANGE_THRESHOLD
 )
+from avito_api import AvitoAPI, CircuitOpenError
+from storage import Storage
+
 logger = logging.getLogger(__name__)
 
 # Хранилище данных пользователей
-user_items: Dict[int, Dict[str, float]] = {}  # user_id -> {item_id: last_price}
+storage = Storage(DATABASE_PATH)
+user_items = storage.user_items  # user_id -> {item_id: last_price}, изменять через storage
 user_searches: Dict[int, Set[str]] = {}  # user_id -> set of search queries
 
+def _maybe_int(value: Optional[str]) -> Optional[int]:
+    """Преобразовать поле поискового запроса в число; пустое поле - None, иначе ValueError"""
+    if value is None or not value.strip():
+        return None
+    return int(value)
+
 class AvitoBot:
     def __init__(self):
         self.api = AvitoAPI()
 
+    async def post_init(self, application: Application) -> None:
+        """Загрузить сохранённые данные при запуске бота"""
+        await storage.open()
+
+    async def shutdown(self, application: Application) -> None:
+        """Закрыть соединения с API и хранилище при остановке бота"""
+        await self.api.close()
+        await storage.close()
+
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Обработчик команды /start"""
         await update.message.reply_text(
@@ -65,11 +83,12 @@ class AvitoBot:
             await update.message.reply_text("У вас нет отслеживаемых объявлений.")
             return
 
-        message = "Ваши отслеживаемые объявления:\n\n"
-        for i, (item_id, price) in enumerate(user_items[user_id].items(), 1):
-            message += f"{i}. ID: {item_id} - Последняя цена: {price:,.2f} ₽\n"
-        
-        await update.message.reply_text(message)
+        parts = ["Ваши отслеживаемые объявления:\n\n"]
+        parts.extend(
+            f"{i}. ID: {item_id} - Последняя цена: {price:,.2f} ₽\n"
+            for i, (item_id, price) in enumerate(user_items[user_id].items(), 1)
+        )
+        await update.message.reply_text("".join(parts))
 
     async def remove_item(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Удалить объявление из отслеживания"""
@@ -78,82 +97,91 @@ class AvitoBot:
             await update.message.reply_text("У вас нет отслеживаемых объявлений.")
             return
 
-        items = list(user_items[user_id].items())
-        message = "Выберите номер объявления для удаления:\n\n"
-        for i, (item_id, price) in enumerate(items, 1):
-            message += f"{i}. ID: {item_id} - Цена: {price:,.2f} ₽\n"
-        
-        await update.message.reply_text(message)
+        parts = ["Выберите номер объявления для удаления:\n\n"]
+        parts.extend(
+            f"{i}. ID: {item_id} - Цена: {price:,.2f} ₽\n"
+            for i, (item_id, price) in enumerate(user_items[user_id].items(), 1)
+        )
+        await update.message.reply_text("".join(parts))
 
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        """Обработчик входящих сообщений"""
-        text = update.message.text
-        user_id = update.effective_user.id
+        """Обработчик остальных сообщений: простой поиск по запросу"""
+        await self.search_items(update, update.message.text.strip())
 
-        # Обработка номера для удаления объявления
-        if text.isdigit():
-            if user_id in user_items and user_items[user_id]:
-                try:
-                    index = int(text) - 1
-                    items = list(user_items[user_id].items())
-                    if 0 <= index < len(items):
-                        item_id, _ = items[index]
-                        del user_items[user_id][item_id]
-                        await update.message.reply_text(f"Объявление {item_id} удалено из отслеживания")
-                    else:
-                        await update.message.reply_text("Неверный номер объявления")
-                except Exception as e:
-                    logger.error(f"Error removing item: {e}")
-                    await update.message.reply_text("Произошла ошибка при удалении объявления")
+    async def handle_search(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Обработчик поискового запроса с параметрами через |"""
+        text = update.message.text
+        # Парсинг параметров поиска: берём первые пять полей, лишние поля после цены отбрасываем
+        query, category, location, price_from, price_to = (text.split("|", 5) + [None] * 5)[:5]
+        try:
+            price_from = _maybe_int(price_from)
+            price_to = _maybe_int(price_to)
+        except ValueError:
+            await update.message.reply_text(
+                "Ошибка при обработке запроса. Убедитесь, что формат корректен:\n"
+                "Запрос | Категория | Город | Цена от | Цена до"
+            )
             return
 
-        # Обработка поискового запроса
-        if "|" in text:
-            # Парсинг параметров поиска
-            params = [p.strip() for p in text.split("|")]
-            try:
-                search_query = params[0]
-                category = params[1] if len(params) > 1 else None
-                location = params[2] if len(params) > 2 else None
-                price_from = int(params[3]) if len(params) > 3 else None
-                price_to = int(params[4]) if len(params) > 4 else None
-
-                await self.search_items(update, search_query, category, location, price_from, price_to)
-            except Exception as e:
-                logger.error(f"Error processing search query: {e}")
-                await update.message.reply_text(
-                    "Ошибка при обработке запроса. Убедитесь, что формат корректен:\n"
-                    "Запрос | Категория | Город | Цена от | Цена до"
-                )
-            return
+        await self.search_items(
+            update,
+            query.strip(),
+            category.strip() if category else None,
+            location.strip() if location else None,
+            price_from,
+            price_to
+        )
 
-        # Обработка ID объявления
-        if re.match(r'^\d+$', text):
-            if user_id not in user_items:
-                user_items[user_id] = {}
+    async def handle_number(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Обработчик числа: номер из списка /remove или ID объявления"""
+        text = update.message.text.strip()
+        user_id = update.effective_user.id
+        # Номера в списке не превышают количества отслеживаемых объявлений,
+        # а ID объявлений на Авито намного длиннее
+        number = int(text)
+        if 1 <= number <= len(user_items.get(user_id, {})):
+            await self._remove_by_index(update, user_id, number - 1)
+        else:
+            await self._add_item(update, user_id, text)
+
+    async def _remove_by_index(self, update: Update, user_id: int, index: int) -> None:
+        """Удалить объявление по номеру из списка"""
+        try:
+            items = list(user_items.get(user_id, {}))
+            if 0 <= index < len(items):
+                item_id = items[index]
+                storage.remove(user_id, item_id)
+                await update.message.reply_text(f"Объявление {item_id} удалено из отслеживания")
+            else:
+                await update.message.reply_text("Неверный номер объявления")
+        except Exception as e:
+            logger.error(f"Error removing item: {e}")
+            await update.message.reply_text("Произошла ошибка при удалении объявления")
+
+    async def _add_item(self, update: Update, user_id: int, item_id: str) -> None:
+        """Добавить объявление в отслеживание по ID"""
+        if len(user_items.get(user_id, {})) >= MAX_ITEMS_PER_USER:
+            await update.message.reply_text(
+                f"Достигнут лимит отслеживаемых объявлений ({MAX_ITEMS_PER_USER}). "
+                "Удалите некоторые объявления с помощью команды /remove"
+            )
+            return
 
-            if len(user_items[user_id]) >= MAX_ITEMS_PER_USER:
+        try:
+            item_details = await self.api.get_item_details(item_id)
+            if item_details:
+                price = float(item_details.get('price', 0))
+                storage.set_price(user_id, item_id, price)
                 await update.message.reply_text(
-                    f"Достигнут лимит отслеживаемых объявлений ({MAX_ITEMS_PER_USER}). "
-                    "Удалите некоторые объявления с помощью команды /remove"
+                    f"✅ Объявление добавлено в отслеживание!\n"
+                    f"💰 Текущая цена: {price:,.2f} ₽\n"
+                    f"🔄 Проверка цены каждые {CHECK_INTERVAL // 60} минут"
                 )
-                return
-
-            try:
-                item_details = await self.api.get_item_details(text)
-                if item_details:
-                    price = float(item_details.get('price', 0))
-                    user_items[user_id][text] = price
-                    await update.message.reply_text(
-                        f"✅ Объявление добавлено в отслеживание!\n"
-                        f"💰 Текущая цена: {price:,.2f} ₽\n"
-                        f"🔄 Проверка цены каждые {CHECK_INTERVAL // 60} минут"
-                    )
-                else:
-                    await update.message.reply_text("Объявление не найдено")
-            except Exception as e:
-                logger.error(f"Error adding item: {e}")
-                await update.message.reply_text("Ошибка при добавлении объявления")
+            else:
+                await update.message.reply_text("Объявление не найдено")
+        except Exception as e:
+            logger.error(f"Error adding item: {e}")
+            await update.message.reply_text("Ошибка при добавлении объявления")
 
     async def search_items(
         self,
@@ -169,20 +197,14 @@ class AvitoBot:
             # Получаем ID категории если указана
             category_id = None
             if category:
-                categories = await self.api.get_categories()
-                category_id = next(
-                    (cat['id'] for cat in categories if cat['name'].lower() == category.lower()),
-                    None
-                )
+                category_index = await self.api.get_category_index()
+                category_id = category_index.get(category.lower())
 
             # Получаем ID локации если указана
             location_id = None
             if location:
-                locations = await self.api.get_locations(location)
-                location_id = next(
-                    (loc['id'] for loc in locations if loc['name'].lower() == location.lower()),
-                    None
-                )
+                location_index = await self.api.get_location_index(location)
+                location_id = location_index.get(location.lower())
 
             # Выполняем поиск
             results = await self.api.search_items(
@@ -198,18 +220,18 @@ class AvitoBot:
                 return
 
             # Формируем сообщение с результатами
-            message = "Результаты поиска:\n\n"
+            parts = ["Результаты поиска:\n\n"]
             for item in results['items'][:5]:  # Показываем только первые 5 результатов
                 price = float(item.get('price', 0))
-                message += (
+                parts.append(
                     f"📌 {item['title']}\n"
                     f"💰 Цена: {price:,.2f} ₽\n"
                     f"📍 {item.get('location', 'Не указано')}\n"
                     f"🔗 ID: {item['id']}\n\n"
                 )
 
-            message += "\nЧтобы отслеживать объявление, отправьте его ID"
-            await update.message.reply_text(message)
+            parts.append("\nЧтобы отслеживать объявление, отправьте его ID")
+            await update.message.reply_text("".join(parts))
 
         except Exception as e:
             logger.error(f"Error searching items: {e}")
@@ -217,43 +239,97 @@ class AvitoBot:
 
     async def check_prices(self, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Периодическая проверка цен объявлений"""
+        # Каждое объявление запрашиваем один раз, даже если его отслеживают несколько пользователей
+        # Снимок строится без await, поэтому обработчики не могут изменить словари
+        # во время обхода, и копировать их не нужно
+        subscribers: Dict[str, List[int]] = {}
         for user_id, items in user_items.items():
-            for item_id, last_price in items.copy().items():
-                try:
-                    item_details = await self.api.get_item_details(item_id)
-                    if not item_details:
-                        # Объявление больше не доступно
-                        del items[item_id]
-                        await context.bot.send_message(
-                            chat_id=user_id,
-                            text=f"❌ Объявление {item_id} больше не доступно и удалено из отслеживания"
+            for item_id in items:
+                subscribers.setdefault(item_id, []).append(user_id)
+
+        # Число одновременных запросов ограничивает AvitoAPI (BACKGROUND_CONCURRENCY)
+        results = await asyncio.gather(
+            *(
+                self.api.get_item_details(item_id, priority='background')
+                for item_id in subscribers
+            ),
+            return_exceptions=True
+        )
+
+        circuit_open = False
+        for item_id, item_details in zip(subscribers, results):
+            if isinstance(item_details, CircuitOpenError):
+                circuit_open = True
+                continue
+            if isinstance(item_details, Exception):
+                logger.error(f"Error checking price for item {item_id}: {item_details}")
+                continue
+            for user_id in subscribers[item_id]:
+                await self._update_item_price(context, user_id, item_id, item_details)
+
+        if circuit_open:
+            logger.warning("Avito API unavailable, price check skipped for some items")
+
+    async def _update_item_price(
+        self,
+        context: ContextTypes.DEFAULT_TYPE,
+        user_id: int,
+        item_id: str,
+        item_details: Dict
+    ) -> None:
+        """Сравнить цену объявления с сохранённой и уведомить пользователя"""
+        items = user_items.get(user_id, {})
+        last_price = items.get(item_id)
+        if last_price is None:
+            # Пользователь удалил объявление, пока шла проверка
+            return
+
+        try:
+            if not item_details:
+                # Объявление больше не доступно
+                storage.remove(user_id, item_id)
+                await context.bot.send_message(
+                    chat_id=user_id,
+                    text=f"❌ Объявление {item_id} больше не доступно и удалено из отслеживания"
+                )
+                return
+
+            current_price = float(item_details.get('price', 0))
+            if current_price != last_price:
+                price_change = ((current_price - last_price) / last_price) * 100
+                if abs(price_change) >= PRICE_CHANGE_THRESHOLD:
+                    direction = "выросла" if current_price > last_price else "снизилась"
+                    await context.bot.send_message(
+                        chat_id=user_id,
+                        text=(
+                            f"🚨 Изменение цены в объявлении!\n"
+                            f"ID: {item_id}\n"
+                            f"Название: {item_details.get('title', 'Не указано')}\n"
+                            f"Цена {direction} на {abs(price_change):.2f}%\n"
+                            f"С {last_price:,.2f} ₽ до {current_price:,.2f} ₽"
                         )
-                        continue
-
-                    current_price = float(item_details.get('price', 0))
-                    if current_price != last_price:
-                        price_change = ((current_price - last_price) / last_price) * 100
-                        if abs(price_change) >= PRICE_CHANGE_THRESHOLD:
-                            direction = "выросла" if current_price > last_price else "снизилась"
-                            await context.bot.send_message(
-                                chat_id=user_id,
-                                text=(
-                                    f"🚨 Изменение цены в объявлении!\n"
-                                    f"ID: {item_id}\n"
-                                    f"Название: {item_details.get('title', 'Не указано')}\n"
-                                    f"Цена {direction} на {abs(price_change):.2f}%\n"
-                                    f"С {last_price:,.2f} ₽ до {current_price:,.2f} ₽"
-                                )
-                            )
-                            items[item_id] = current_price
-
-                except Exception as e:
-                    logger.error(f"Error checking price for item {item_id}: {e}")
+                    )
+                    storage.set_price(user_id, item_id, current_price)
+
+        except Exception as e:
+            logger.error(f"Error checking price for item {item_id}: {e}")
 
 def main() -> None:
     """Запуск бота"""
+    # Настройка логирования
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+
     avito_bot = AvitoBot()
-    application = Application.builder().token(BOT_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .post_init(avito_bot.post_init)
+        .post_shutdown(avito_bot.shutdown)
+        .build()
+    )
 
     # Добавляем обработчики команд
     application.add_handler(CommandHandler("start", avito_bot.start))
@@ -261,6 +337,12 @@ def main() -> None:
     application.add_handler(CommandHandler("search", avito_bot.search_command))
     application.add_handler(CommandHandler("list", avito_bot.list_items))
     application.add_handler(CommandHandler("remove", avito_bot.remove_item))
+
+    # Обработчики сообщений проверяются по порядку, срабатывает первый подходящий
+    application.add_handler(MessageHandler(filters.Regex(r'^\d+$'), avito_bot.handle_number))
+    application.add_handler(
+        MessageHandler(filters.Regex(r'\|') & ~filters.COMMAND, avito_bot.handle_search)
+    )
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, avito_bot.handle_message))
 
     # Добавляем периодическую задачу проверки цен
@@ -17,15 +17,40 @@ AVITO_API_BASE_URL = "https://api.avito.ru"
 AVITO_AUTH_URL = f"{AVITO_API_BASE_URL}/token"
 
 # Настройки запросов
-REQUEST_TIMEOUT = 30  # секунды
+REQUEST_TIMEOUT = 30  # секунды, по умолчанию
+DETAILS_TIMEOUT = 5  # секунды, объявление и его статистика
+SEARCH_TIMEOUT = 15  # секунды, поиск объявлений
+AUTH_TIMEOUT = 10  # секунды, получение токена
+TOKEN_REFRESH_MARGIN = 60  # секунды до истечения токена, когда его пора обновить
+TOKEN_REFRESH_COOLDOWN = 10  # секунды без повторных попыток после неудачного обновления токена
+CONNECT_TIMEOUT = 5  # секунды на установку соединения
 MAX_RETRIES = 3
-RETRY_DELAY = 5  # секунды
+RETRY_DELAY = 5  # секунды, база экспоненциальной задержки
+RETRY_MAX_DELAY = 30  # секунды, верхняя граница задержки
+RATE_LIMIT_MIN_REMAINING = 2  # остаток лимита, при котором ждём его сброса
+RATE_LIMIT_MAX_WAIT = 60  # секунды, максимальное ожидание сброса лимита или Retry-After
+
+# Настройки пула соединений
+CONNECTION_LIMIT = 100  # всего соединений
+CONNECTION_LIMIT_PER_HOST = 32  # соединений на один хост
+DNS_CACHE_TTL = 300  # секунды
+KEEPALIVE_TIMEOUT = 60  # секунды
+INTERACTIVE_CONCURRENCY = 16  # одновременных запросов от пользователей
+BACKGROUND_CONCURRENCY = 16  # одновременных запросов фоновой проверки цен
+
+# Настройки автоматического выключателя (circuit breaker)
+CIRCUIT_FAIL_THRESHOLD = 5  # неудачных запросов подряд до размыкания
+CIRCUIT_RECOVERY_TIMEOUT = 60  # секунды до пробного запроса
 
 # Настройки мониторинга
 CHECK_INTERVAL = 300  # 5 минут
 MAX_ITEMS_PER_USER = 10
 PRICE_CHANGE_THRESHOLD = 5  # процент изменения цены для уведомления
 
+# Настройки хранилища
+DATABASE_PATH = os.getenv('DATABASE_PATH', 'avito_monitor.db')
+STORAGE_FLUSH_INTERVAL = 0.5  # секунды между пакетными записями в базу
+
 # Настройки кэширования
 CACHE_TTL = 600  # 10 минут
 MAX_CACHE_ITEMS = 1000
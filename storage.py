@@ -0,0 +1,108 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+import aiosqlite
+from config import STORAGE_FLUSH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Операция записи: (тип, user_id, item_id, цена)
+Operation = Tuple[str, int, str, Optional[float]]
+
+class Storage:
+    """Хранилище отслеживаемых объявлений: чтение из памяти, фоновая запись в SQLite"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.user_items: Dict[int, Dict[str, float]] = {}  # user_id -> {item_id: last_price}
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._db: Optional[aiosqlite.Connection] = None
+        self._writer: Optional[asyncio.Task] = None
+
+    async def open(self) -> None:
+        """Открыть базу, загрузить данные в память и запустить фоновую запись"""
+        self._db = await aiosqlite.connect(self.path)
+        await self._db.execute(
+            "CREATE TABLE IF NOT EXISTS tracked_items ("
+            "user_id INTEGER NOT NULL, "
+            "item_id TEXT NOT NULL, "
+            "last_price REAL NOT NULL, "
+            "PRIMARY KEY (user_id, item_id))"
+        )
+        await self._db.commit()
+
+        async with self._db.execute(
+            "SELECT user_id, item_id, last_price FROM tracked_items"
+        ) as cursor:
+            async for user_id, item_id, last_price in cursor:
+                self.user_items.setdefault(user_id, {})[item_id] = last_price
+
+        self._writer = asyncio.create_task(self._write_behind())
+
+    def set_price(self, user_id: int, item_id: str, price: float) -> None:
+        """Добавить объявление или обновить его цену"""
+        self.user_items.setdefault(user_id, {})[item_id] = price
+        self._queue.put_nowait(('upsert', user_id, item_id, price))
+
+    def remove(self, user_id: int, item_id: str) -> None:
+        """Удалить объявление из отслеживания"""
+        items = self.user_items.get(user_id)
+        if items is not None:
+            items.pop(item_id, None)
+        self._queue.put_nowait(('delete', user_id, item_id, None))
+
+    async def _write_behind(self) -> None:
+        """Фоновая задача: собирать изменения и записывать их пачками"""
+        pending: List[Operation] = []
+        running = True
+        while running:
+            if not pending:
+                pending.append(await self._queue.get())
+            await asyncio.sleep(STORAGE_FLUSH_INTERVAL)
+            while not self._queue.empty():
+                pending.append(self._queue.get_nowait())
+
+            # None в очереди - сигнал остановки от close()
+            if None in pending:
+                running = False
+                pending = [op for op in pending if op is not None]
+
+            try:
+                await self._flush(pending)
+                pending = []
+            except Exception as e:
+                # Пачку не теряем: повторим её вместе со следующими изменениями
+                logger.error(f"Error writing to storage, will retry: {e}")
+
+        if pending:
+            logger.error(f"{len(pending)} storage changes were not saved")
+
+    async def _flush(self, operations: List[Operation]) -> None:
+        """Записать пачку изменений в одной транзакции"""
+        try:
+            for op, user_id, item_id, price in operations:
+                if op == 'upsert':
+                    await self._db.execute(
+                        "INSERT INTO tracked_items (user_id, item_id, last_price) VALUES (?, ?, ?) "
+                        "ON CONFLICT (user_id, item_id) DO UPDATE SET last_price = excluded.last_price",
+                        (user_id, item_id, price)
+                    )
+                else:
+                    await self._db.execute(
+                        "DELETE FROM tracked_items WHERE user_id = ? AND item_id = ?",
+                        (user_id, item_id)
+                    )
+            await self._db.commit()
+        except Exception:
+            await self._db.rollback()
+            raise
+
+    async def close(self) -> None:
+        """Записать оставшиеся изменения и закрыть базу"""
+        if self._writer is not None:
+            self._queue.put_nowait(None)
+            await self._writer
+            self._writer = None
+        if self._db is not None:
+            await self._db.close()
+            self._db = None